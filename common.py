@@ -0,0 +1,190 @@
+# common.py
+# Helpers shared by the seed and peer nodes.
+import atexit
+import logging
+import logging.handlers
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+
+# Seconds seeds and peers wait for their listening socket to be ready, and
+# peers for a seed's peer list.
+STARTUP_TIMEOUT = 2.0
+
+# Every message on the wire is framed as a 4-byte big-endian payload length
+# followed by the payload bytes.
+FRAME_HEADER = struct.Struct(">I")
+# Largest payload accepted from the wire; a longer length means the peer is
+# not speaking this protocol (e.g. unframed text), so its connection is closed.
+MAX_FRAME_SIZE = 1 << 20
+# Maximum number of buffers passed to a single sendmsg() call (the usual IOV_MAX).
+MAX_IOVECS = 1024
+
+# Last formatted timestamp as (second, text); replaced as a whole so that
+# concurrent readers always see a matching pair.
+_ts_cache = (0, "")
+
+
+def now_ts():
+    """
+    Return the current local time formatted as "%Y-%m-%d %H:%M:%S".
+    The formatted string is cached and only rebuilt when the second changes.
+    """
+    global _ts_cache
+    second = int(time.time())
+    cached_second, text = _ts_cache
+    if second != cached_second:
+        text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        _ts_cache = (second, text)
+    return text
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """
+    QueueListener whose stop() may be called more than once, so the listener
+    can be stopped explicitly and again at interpreter exit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stop_lock = threading.Lock()
+        self._stopped = False
+
+    def stop(self):
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            super().stop()
+            for handler in self.handlers:
+                handler.close()
+
+
+def create_logger(name, logfile):
+    """
+    Create a logger that writes plain log lines to the console and to a log file.
+    Records are put on an in-memory queue and written by a background
+    QueueListener thread, so callers never wait on file I/O and the log file
+    stays open instead of being reopened for every line.
+    The listener is stopped at interpreter exit so queued lines are written out.
+    Returns the logger and the listener (stop the listener to flush and close).
+    """
+    log_queue = queue.Queue()
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    formatter = logging.Formatter("%(message)s")
+    file_handler = logging.FileHandler(logfile)
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(formatter)
+    listener = _LogListener(log_queue, file_handler, console_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger, listener
+
+
+def encode_frame(payload):
+    """
+    Return the payload bytes prefixed with their 4-byte length header.
+    """
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def _send_once(connection, buffers):
+    """
+    Write the front of 'buffers' with one scatter-gather sendmsg() call and
+    return the number of bytes sent. Falls back to send() on a joined copy
+    where sendmsg() is unavailable.
+    """
+    if hasattr(socket.socket, "sendmsg"):
+        return connection.sendmsg(buffers[:MAX_IOVECS])
+    return connection.send(b"".join(buffers[:MAX_IOVECS]))
+
+
+def _consume(buffers, sent):
+    """
+    Remove the first 'sent' bytes from the list 'buffers', trimming a
+    partially sent buffer with a memoryview instead of copying it.
+    """
+    i = 0
+    while i < len(buffers) and sent >= len(buffers[i]):
+        sent -= len(buffers[i])
+        i += 1
+    del buffers[:i]
+    if sent:
+        buffers[0] = memoryview(buffers[0])[sent:]
+
+
+def sendmsg_all(connection, buffers):
+    """
+    Send all 'buffers' in order on a blocking connection using scatter-gather
+    sendmsg(), so the kernel writes them in one writev() without concatenating
+    them first. Retries after partial sends.
+    """
+    buffers = list(buffers)
+    while buffers:
+        _consume(buffers, _send_once(connection, buffers))
+
+
+def send_available(connection, buffers):
+    """
+    Send as much of the list 'buffers' as a non-blocking connection accepts
+    right now and remove the sent bytes from the list.
+    Returns True once every buffer has been sent.
+    """
+    try:
+        while buffers:
+            _consume(buffers, _send_once(connection, buffers))
+    except BlockingIOError:
+        pass
+    return not buffers
+
+
+def send_frame(connection, payload):
+    """
+    Send the payload as a length-prefixed message, passing the header and the
+    payload to the kernel as separate buffers.
+    """
+    sendmsg_all(connection, (FRAME_HEADER.pack(len(payload)), payload))
+
+
+def take_frame(buf):
+    """
+    Remove the first complete frame from the bytearray 'buf' and return its payload.
+    Returns None if 'buf' does not yet hold a complete frame.
+    Raises ValueError if the header announces more than MAX_FRAME_SIZE bytes.
+    """
+    if len(buf) < FRAME_HEADER.size:
+        return None
+    (length,) = FRAME_HEADER.unpack_from(buf)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    end = FRAME_HEADER.size + length
+    if len(buf) < end:
+        return None
+    payload = bytes(buf[FRAME_HEADER.size:end])
+    del buf[:end]
+    return payload
+
+
+def recv_frame(connection, buf):
+    """
+    Read from a blocking connection until a complete frame is available and
+    return its payload. 'buf' is the connection's bytearray accumulator and
+    keeps any bytes received beyond the returned frame.
+    Returns None if the connection is closed.
+    Raises ValueError if an oversized frame header is received.
+    """
+    payload = take_frame(buf)
+    while payload is None:
+        data = connection.recv(4096)
+        if not data:
+            return None
+        buf += data
+        payload = take_frame(buf)
+    return payload
@@ -10,6 +10,24 @@ import config_file  # Contains seed node configuration (IP and port info)
 # Retrieve seed node information from the config file.
 seed_info = config_file.seed_info
 
+# Exponent applied to (degree + 1) when weighting candidate peers; values above 1
+# favour well-connected peers (preferential attachment), giving a power-law degree distribution.
+DEGREE_WEIGHT_EXPONENT = 1.5
+
+def select_peers(candidate_peers, degree_count, num_connections):
+    """
+    Select num_connections distinct peers from candidate_peers, each draw
+    weighted by (degree + 1) ** DEGREE_WEIGHT_EXPONENT.
+    """
+    candidates = list(candidate_peers)
+    selected = []
+    for _ in range(min(num_connections, len(candidates))):
+        weights = [(degree_count.get(peer, 0) + 1) ** DEGREE_WEIGHT_EXPONENT for peer in candidates]
+        peer = random.choices(candidates, weights=weights, k=1)[0]
+        candidates.remove(peer)
+        selected.append(peer)
+    return selected
+
 def main():
     # -----------------------------------------------------------------------
     # Start Seed Nodes
@@ -21,24 +39,25 @@ def main():
         # Create a new Seed instance with the given IP and port.
         s = Seed(ip, port)
         # Start the seed node (this begins listening for connections).
+        # Returns once the seed is listening.
         s.start()
         # Add the seed node to the list for later reference.
         seed_list.append(s)
-    
-    # Allow a short delay to ensure that all seed nodes are up and running.
-    time.sleep(2)
 
     # -----------------------------------------------------------------------
     # Start Peer Nodes
     # -----------------------------------------------------------------------
     peer_list = []  # List to store peer node instances.
     num_seeds = len(seed_list)  # Total number of seed nodes.
+    # Number of peer connections per (ip, port), used for weighted peer selection.
+    degree_count = {}
     
     # Create 5 peer nodes with ports ranging from 8000 to 8003.
     for port in range(8000, 8003):
         # Create a new Peer instance with localhost as IP and the given port.
         p = Peer("127.0.0.1", port)
         # Start the peer (this begins listening for incoming connections and starts gossiping).
+        # Returns once the peer is listening.
         p.start()
         
         # -------------------------------------------------------------------
@@ -50,16 +69,14 @@ def main():
         sampled_seeds = random.sample(seed_list, num_seed_connections)
         for seed in sampled_seeds:
             # Connect the peer to each sampled seed node.
+            # Returns once the seed's peer list has been received.
             p.connect_to_seed(seed.host, seed.port)
         
-        # Allow some time for the peer to receive the peer list from the seed nodes.
-        time.sleep(1)
-        
         # -------------------------------------------------------------------
         # Connect to Other Peers:
         # After obtaining peer lists from seeds, select some peers to connect to.
-        # For simulation purposes, a simple random selection is used.
-        # (In a full implementation, a power-law weighted selection could be applied.)
+        # Peers are chosen with probability growing with their current degree
+        # (preferential attachment), so the overlay follows a power-law degree distribution.
         # -------------------------------------------------------------------
         candidate_peers = list(p.peers)
         # Remove self from the candidate list (if the peer's own entry is present).
@@ -67,16 +84,18 @@ def main():
         # Limit the number of connections to a maximum of 4 or the number of available candidates.
         num_connections = min(4, len(candidate_peers))
         if num_connections > 0:
-            # Randomly select peers from the candidate list.
-            selected_peers = random.sample(candidate_peers, num_connections)
+            # Select peers from the candidate list, weighted by degree.
+            selected_peers = select_peers(candidate_peers, degree_count, num_connections)
             for peer_ip, peer_port in selected_peers:
-                # Connect to each selected peer.
-                p.connect_to_peer(peer_ip, peer_port)
+                # Connect to each selected peer; skip failed or duplicate connections.
+                if not p.connect_to_peer(peer_ip, peer_port):
+                    continue
+                # Both endpoints gain one connection.
+                degree_count[(peer_ip, peer_port)] = degree_count.get((peer_ip, peer_port), 0) + 1
+                degree_count[("127.0.0.1", port)] = degree_count.get(("127.0.0.1", port), 0) + 1
         
         # Add the current peer to the peer_list for future reference.
         peer_list.append(p)
-        # Short delay between starting each peer.
-        time.sleep(1)
     
     # -----------------------------------------------------------------------
     # Simulate Network Operation
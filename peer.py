@@ -1,21 +1,53 @@
 # peer.py
 import socket
 import threading
-import datetime
+import collections
+import selectors
 import time
-import subprocess
-import hashlib
+import xxhash
+from common import FRAME_HEADER, MAX_IOVECS, STARTUP_TIMEOUT, create_logger, now_ts, send_available, send_frame, take_frame
+
+# Maximum number of message hashes remembered for duplicate detection.
+MAX_SEEN_HASHES = 65536
+# Maximum number of gossip payloads kept to answer WANT requests.
+MAX_PAYLOAD_CACHE = 4096
+# Seconds to wait for the payload of a requested hash before asking the next
+# peer that announced it.
+WANT_TIMEOUT = 5
+# Seconds between heartbeat PINGs, also used as the TCP keepalive idle/interval time.
+HEARTBEAT_INTERVAL = 13
+# Consecutive missed PONGs (or keepalive probes) before a peer is considered dead.
+HEARTBEAT_MAX_FAILURES = 3
+# Seconds the gossip thread waits before its first broadcast, so that initial
+# peer connections can be established.
+GOSSIP_START_DELAY = 3
+# Longest time the event loop blocks in select(), so sockets registered from
+# other threads and a shutdown request are picked up promptly.
+SELECT_TIMEOUT = 1.0
+# Seconds queued peer messages may wait to be coalesced into a single send.
+SEND_FLUSH_INTERVAL = 0.005
+# Queued messages for one connection that trigger an immediate flush; each message
+# takes two buffers (header and payload), so a full queue fits in one sendmsg() call.
+SEND_QUEUE_LIMIT = MAX_IOVECS // 2
+# Unsent bytes allowed to build up for a peer that is not reading before
+# the connection is dropped.
+SEND_BACKLOG_LIMIT = 1 << 20
 
 # ---------------------------------------------------------------------------
 # Message class to represent a gossip message.
-# It stores the message text, its SHA-256 hash, a list of sender info,
-# and a list of connections to which the message has been forwarded.
+# It stores the message text and its encoded bytes, its 64-bit xxHash3 digest,
+# a list of sender info, and a list of connections to which the message has been forwarded.
 # ---------------------------------------------------------------------------
 class Message:
-    def __init__(self, message):
+    def __init__(self, message, data_bytes=None):
         self.message = message
+        # Encoded message, reused for hashing and for sending the payload.
+        self.data_bytes = data_bytes if data_bytes is not None else message.encode()
         # Compute hash for the message to avoid duplicate processing.
-        self.hash = hashlib.sha256(message.encode()).hexdigest()
+        # A non-cryptographic hash is enough for in-memory deduplication.
+        # If messages ever need a cryptographic digest (e.g. for signing), compute it
+        # separately with hashlib.blake2b(digest_size=16) rather than SHA-256.
+        self.hash = xxhash.xxh3_64_intdigest(self.data_bytes)
         self.received_from = []  # List of sender identifiers (e.g., (ip, port) tuples).
         self.sent_to = []        # List of destination identifiers (e.g., (ip, port) tuples).
 
@@ -23,6 +55,7 @@ class Message:
 # Peer class: Implements a peer node in the P2P gossip network.
 # Handles connecting to seed nodes and other peers, receiving and forwarding
 # messages, and monitoring peer liveness via a heartbeat mechanism.
+# All sockets are served by a single event loop thread (see listen()).
 # ---------------------------------------------------------------------------
 class Peer:
     def __init__(self, host, port):
@@ -33,25 +66,143 @@ class Peer:
         # Allow the socket to reuse the address (helps during restarts).
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.seed = []       # List of connections to seed nodes.
-        # List of connected peers: each element is [peer_ip, peer_port, connection].
-        self.connected = []
+        # Connected peers: maps (peer_ip, peer_port) to the connection.
+        # Holds at most one connection per designated peer.
+        self.connected = {}
+        # Connections this peer initiated via connect_to_peer.
+        self.outgoing = set()
         self.logfile = f"logfile_peer_{self.port}.txt"  # Log file name based on peer port.
+        # Logger writing to the console and the log file from a background thread.
+        self.logger, self.log_listener = create_logger(f"peer.{self.port}", self.logfile)
         # Set of peer info tuples received from seed nodes.
         self.peers = set()
         # Message List (ML): stores Message objects to avoid duplicate processing.
         self.messages = []
+        # Hashes of messages already seen, kept in insertion order so the
+        # oldest entries can be evicted once MAX_SEEN_HASHES is reached.
+        self.seen_hashes = collections.OrderedDict()
+        self.seen_lock = threading.Lock()
+        # Hashes with a WANT outstanding (oldest request first), so simultaneous HAVEs
+        # from several peers fetch the payload only once. Each entry is
+        # [sent_at, asked_connection, deque of other announcing connections];
+        # the next announcer is asked if the payload does not arrive in time.
+        self.pending_wants = collections.OrderedDict()
+        # Recently seen gossip payloads keyed by hash, used to answer WANT requests.
+        self.hash_to_payload = collections.OrderedDict()
         # Mapping from connection object to the designated (listening) peer port.
         self.conn_designated = {}
+        # Mapping from connection object to its cached (peername, sockname) addresses,
+        # so logging and forwarding do not query the socket each time.
+        self.conn_meta = {}
+        # Heartbeat state per peer connection: [peer_ip, peer_port, failures, pong_received].
+        self.heartbeats = {}
+        self.next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+        # Selector multiplexing the listening socket and all peer/seed connections.
+        # Each registration carries the handler to call when the socket is readable.
+        self.selector = selectors.DefaultSelector()
+        self.running = False
+        # Thread running the event loop; sockets are only closed from this thread.
+        self.loop_thread = None
+        # Set once the listening socket accepts connections.
+        self.listen_ready = threading.Event()
+        # Set whenever a PEERS list arrives from a seed.
+        self.peers_received = threading.Event()
+        # Outgoing peer messages are queued per connection as (header, payload)
+        # buffers, then written by the event loop with one sendmsg per connection.
+        self.send_buf = {}
+        self.send_lock = threading.Lock()
+        self.flush_deadline = None
+        # Buffers the kernel has not accepted yet per peer connection (event loop only).
+        # A connection with unsent data is also watched for EVENT_WRITE.
+        self.write_buf = {}
+        # Partial incoming data per peer/seed connection, split into length-prefixed messages.
+        self.recv_buf = {}
+        # Socket pair used to wake the event loop when another thread queues data.
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_w.setblocking(False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, self.handle_wakeup)
 
     # -----------------------------------------------------------------------
     # Logging function: Prints messages to the console and appends them to a log file.
+    # The actual writes happen on the logger's background listener thread.
     # -----------------------------------------------------------------------
     def log(self, message):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = now_ts()
         log_message = f"[{timestamp}] {message}"
-        print(log_message)
-        with open(self.logfile, "a") as f:
-            f.write(log_message + "\n")
+        self.logger.info(log_message)
+
+    # -----------------------------------------------------------------------
+    # Record a message hash as seen.
+    # Returns True if the hash is new, False if the message is a duplicate.
+    # -----------------------------------------------------------------------
+    def mark_seen(self, msg_hash):
+        with self.seen_lock:
+            if msg_hash in self.seen_hashes:
+                self.seen_hashes.move_to_end(msg_hash)
+                return False
+            self.seen_hashes[msg_hash] = None
+            if len(self.seen_hashes) > MAX_SEEN_HASHES:
+                self.seen_hashes.popitem(last=False)
+            return True
+
+    # -----------------------------------------------------------------------
+    # Decide whether a HAVE announcement received on 'connection' should be
+    # answered with a WANT. Returns True if the hash is unseen and no WANT for
+    # it is outstanding; the hash is then recorded as requested from 'connection'.
+    # If a WANT is already outstanding, the announcer is remembered as a
+    # fallback source for the payload.
+    # -----------------------------------------------------------------------
+    def request_hash(self, msg_hash, connection):
+        with self.seen_lock:
+            if msg_hash in self.seen_hashes:
+                return False
+        pending = self.pending_wants.get(msg_hash)
+        if pending is not None:
+            if connection is not pending[1] and connection not in pending[2]:
+                pending[2].append(connection)
+            return False
+        self.pending_wants[msg_hash] = [time.monotonic(), connection, collections.deque()]
+        return True
+
+    # -----------------------------------------------------------------------
+    # Send the WANT for a pending hash to the next announcer whose connection
+    # is still open. The hash is forgotten if no announcer is left, so a later
+    # HAVE starts a new request.
+    # -----------------------------------------------------------------------
+    def request_from_next_announcer(self, msg_hash, pending):
+        others = pending[2]
+        while others:
+            connection = others.popleft()
+            if connection.fileno() != -1:
+                pending[0] = time.monotonic()
+                pending[1] = connection
+                self.pending_wants.move_to_end(msg_hash)
+                self.send_message(connection, f"WANT-{msg_hash:016x}".encode())
+                self.log(f"Requesting {msg_hash:016x} again from {self.get_conn_info(connection)}")
+                return
+        del self.pending_wants[msg_hash]
+
+    # -----------------------------------------------------------------------
+    # Re-request payloads that have not arrived within WANT_TIMEOUT
+    # (called by the event loop).
+    # -----------------------------------------------------------------------
+    def expire_wants(self):
+        deadline = time.monotonic() - WANT_TIMEOUT
+        while self.pending_wants:
+            msg_hash, pending = next(iter(self.pending_wants.items()))
+            if pending[0] > deadline:
+                break
+            self.request_from_next_announcer(msg_hash, pending)
+
+    # -----------------------------------------------------------------------
+    # Cache an encoded gossip payload so it can be sent to peers that request it.
+    # The oldest payload is evicted once MAX_PAYLOAD_CACHE is reached.
+    # -----------------------------------------------------------------------
+    def cache_payload(self, msg_hash, payload):
+        with self.seen_lock:
+            self.hash_to_payload[msg_hash] = payload
+            if len(self.hash_to_payload) > MAX_PAYLOAD_CACHE:
+                self.hash_to_payload.popitem(last=False)
 
     # -----------------------------------------------------------------------
     # Helper function to obtain connection information.
@@ -59,246 +210,569 @@ class Peer:
     # the designated port (if known) for clarity.
     # -----------------------------------------------------------------------
     def get_conn_info(self, connection):
-        try:
-            # Get the remote address and ephemeral port.
-            ephemeral = connection.getpeername()  # Format: (ip, ephemeral_port)
-        except Exception:
-            ephemeral = ("unknown", "unknown")
+        # Cached remote address and ephemeral port, format: (ip, ephemeral_port).
+        meta = self.conn_meta.get(connection)
+        ephemeral = meta[0] if meta else ("unknown", "unknown")
         designated = self.conn_designated.get(connection, None)
         if designated:
             return f"{ephemeral} [Designated: {designated[1]}]"
         else:
             return str(ephemeral)
 
+    # -----------------------------------------------------------------------
+    # Cache the remote and local addresses of a newly established connection.
+    # -----------------------------------------------------------------------
+    def cache_conn_meta(self, connection):
+        self.conn_meta[connection] = (connection.getpeername(), connection.getsockname())
+
+    # -----------------------------------------------------------------------
+    # Return the cached local (ephemeral) port of a connection.
+    # -----------------------------------------------------------------------
+    def get_local_port(self, connection):
+        meta = self.conn_meta.get(connection)
+        return meta[1][1] if meta else "unknown"
+
+    # -----------------------------------------------------------------------
+    # Configure a peer connection: make it non-blocking so a peer that stops
+    # reading cannot stall the event loop, disable Nagle's algorithm so coalesced
+    # writes leave immediately, and enable TCP keepalive so the kernel detects
+    # dead connections; the probe timings are only set where the platform supports them.
+    # -----------------------------------------------------------------------
+    def configure_connection(self, connection):
+        connection.setblocking(False)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, HEARTBEAT_INTERVAL)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, HEARTBEAT_INTERVAL)
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, HEARTBEAT_MAX_FAILURES)
+
+    # -----------------------------------------------------------------------
+    # Queue a message for a peer connection. The message is length-prefixed
+    # and written by the event loop together with other queued messages for the
+    # same connection, at most SEND_FLUSH_INTERVAL seconds later.
+    # -----------------------------------------------------------------------
+    def send_message(self, connection, payload):
+        with self.send_lock:
+            buffers = self.send_buf.setdefault(connection, [])
+            buffers.append(FRAME_HEADER.pack(len(payload)))
+            buffers.append(payload)
+            if len(buffers) >= 2 * SEND_QUEUE_LIMIT:
+                deadline = time.monotonic()
+            elif self.flush_deadline is None:
+                deadline = time.monotonic() + SEND_FLUSH_INTERVAL
+            else:
+                return
+            self.flush_deadline = deadline
+        # Wake the event loop so it picks up the new flush deadline.
+        try:
+            self.wakeup_w.send(b"\0")
+        except OSError:
+            pass
+
+    # -----------------------------------------------------------------------
+    # Write all queued messages, one scatter-gather sendmsg per connection.
+    # Called from the event loop once the flush deadline has passed.
+    # -----------------------------------------------------------------------
+    def flush_send_buffers(self):
+        with self.send_lock:
+            pending = self.send_buf
+            self.send_buf = {}
+            self.flush_deadline = None
+        for connection, buffers in pending.items():
+            self.write_buf.setdefault(connection, []).extend(buffers)
+            self.write_connection(connection)
+
+    # -----------------------------------------------------------------------
+    # Send as much unsent data for a peer connection as it accepts without
+    # blocking (called after a flush and when the connection becomes writable).
+    # The connection is watched for EVENT_WRITE while data remains, and dropped
+    # if more than SEND_BACKLOG_LIMIT bytes build up.
+    # -----------------------------------------------------------------------
+    def write_connection(self, connection):
+        buffers = self.write_buf.get(connection)
+        if buffers is None:
+            return
+        try:
+            done = send_available(connection, buffers)
+        except OSError as e:
+            self.log(f"Failed to send to {self.get_conn_info(connection)}: {e}")
+            self.write_buf.pop(connection, None)
+            self.set_write_interest(connection, False)
+            return
+        if done:
+            self.write_buf.pop(connection, None)
+            self.set_write_interest(connection, False)
+        elif sum(len(buf) for buf in buffers) > SEND_BACKLOG_LIMIT:
+            self.log(f"Peer {self.get_conn_info(connection)} is not reading; dropping the connection.")
+            self.close_connection(connection)
+        else:
+            self.set_write_interest(connection, True)
+
+    # -----------------------------------------------------------------------
+    # Add or remove EVENT_WRITE from a registered connection's selector events.
+    # -----------------------------------------------------------------------
+    def set_write_interest(self, connection, enabled):
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if enabled else selectors.EVENT_READ
+        try:
+            key = self.selector.get_key(connection)
+            if key.events != events:
+                self.selector.modify(connection, events, key.data)
+        except (KeyError, ValueError):
+            pass
+
+    # -----------------------------------------------------------------------
+    # Drain wakeup bytes written by send_message (called by the event loop).
+    # -----------------------------------------------------------------------
+    def handle_wakeup(self, sock):
+        try:
+            sock.recv(4096)
+        except OSError:
+            pass
+
+    # -----------------------------------------------------------------------
+    # Stop serving a connection: remove it from the event loop and close it.
+    # -----------------------------------------------------------------------
+    def close_connection(self, connection):
+        try:
+            self.selector.unregister(connection)
+        except (KeyError, ValueError):
+            pass
+        with self.send_lock:
+            self.send_buf.pop(connection, None)
+        self.write_buf.pop(connection, None)
+        self.recv_buf.pop(connection, None)
+        self.conn_meta.pop(connection, None)
+        self.outgoing.discard(connection)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        # Payloads requested over this connection will not arrive; ask other announcers.
+        for msg_hash, pending in list(self.pending_wants.items()):
+            if pending[1] is connection:
+                self.request_from_next_announcer(msg_hash, pending)
+
     # -----------------------------------------------------------------------
     # Connect to another peer using its IP and designated listening port.
-    # Registers with the peer, starts a thread for handling incoming messages,
-    # and also starts a heartbeat thread to monitor the connection.
+    # Registers with the peer, adds the connection to the event loop for
+    # incoming messages, and starts heartbeat monitoring for it.
+    # Returns True if a new connection was established, False otherwise.
     # -----------------------------------------------------------------------
     def connect_to_peer(self, peer_ip, peer_port):
+        # Keep a single connection per designated peer.
+        if (peer_ip, peer_port) in self.connected:
+            self.log(f"Already connected to peer {peer_ip}:{peer_port}")
+            return False
         try:
             # Create a connection to the remote peer.
             connection = socket.create_connection((peer_ip, peer_port))
-            self.connected.append([peer_ip, peer_port, connection])
+            self.configure_connection(connection)
+            self.connected[(peer_ip, peer_port)] = connection
+            self.outgoing.add(connection)
             # Map the connection to its designated peer info.
             self.conn_designated[connection] = (peer_ip, peer_port)
-            self.log(f"Connected to peer {peer_ip}:{peer_port} (Ephemeral: {connection.getsockname()[1]})")
+            self.cache_conn_meta(connection)
+            self.log(f"Connected to peer {peer_ip}:{peer_port} (Ephemeral: {self.get_local_port(connection)})")
             # Send a registration message to the connected peer.
             store_msg = f"STORE-{self.host}:{self.port}"
-            connection.sendall(store_msg.encode())
-            # Start a thread to handle incoming messages from this peer.
-            threading.Thread(target=self.handle_peer_connection, args=(connection,), daemon=True).start()
-            # Start a heartbeat thread to check liveness of the connection.
-            threading.Thread(target=self.heartbeat, args=(connection, peer_ip, peer_port), daemon=True).start()
+            self.send_message(connection, store_msg.encode())
+            # Handle incoming messages from this peer on the event loop.
+            self.selector.register(connection, selectors.EVENT_READ, self.handle_peer_connection)
+            # Monitor liveness of the connection.
+            self.heartbeats[connection] = [peer_ip, peer_port, 0, True]
+            return True
         except Exception as e:
             self.log(f"Failed to connect to peer {peer_ip}:{peer_port}. Error: {e}")
+            return False
 
     # -----------------------------------------------------------------------
     # Connect to a seed node using its IP and port.
-    # Registers with the seed and starts a thread to handle incoming seed messages.
+    # Registers with the seed and adds the connection to the event loop.
+    # Returns once the seed's peer list has been received (or STARTUP_TIMEOUT expires).
     # -----------------------------------------------------------------------
     def connect_to_seed(self, seed_ip, seed_port):
+        self.peers_received.clear()
         try:
             connection = socket.create_connection((seed_ip, seed_port))
             self.seed.append(connection)
-            self.log(f"Connected to seed {seed_ip}:{seed_port} (Ephemeral: {connection.getsockname()[1]})")
+            self.cache_conn_meta(connection)
+            self.log(f"Connected to seed {seed_ip}:{seed_port} (Ephemeral: {self.get_local_port(connection)})")
             # Send a registration message to the seed.
             store_msg = f"STORE-{self.host}:{self.port}"
-            connection.sendall(store_msg.encode())
-            # Start a thread to handle incoming messages from the seed.
-            threading.Thread(target=self.handle_seed_connection, args=(connection,), daemon=True).start()
+            send_frame(connection, store_msg.encode())
+            # Handle incoming messages from the seed on the event loop.
+            self.selector.register(connection, selectors.EVENT_READ, self.handle_seed_connection)
         except Exception as e:
             self.log(f"Failed to connect to seed {seed_ip}:{seed_port}. Error: {e}")
+            return
+        if not self.peers_received.wait(STARTUP_TIMEOUT):
+            self.log(f"No peer list received from seed {seed_ip}:{seed_port}")
 
     # -----------------------------------------------------------------------
-    # Handle messages coming from a seed node.
-    # Processes peer list updates and dead node notifications.
+    # Read available data from a connection into its receive buffer and return
+    # the complete length-prefixed messages, or None if the connection closed.
+    # -----------------------------------------------------------------------
+    def read_messages(self, connection):
+        try:
+            data = connection.recv(4096)
+        except BlockingIOError:
+            return []
+        if not data:
+            return None
+        buf = self.recv_buf.setdefault(connection, bytearray())
+        buf += data
+        messages = []
+        message = take_frame(buf)
+        while message is not None:
+            messages.append(message)
+            message = take_frame(buf)
+        return messages
+
+    # -----------------------------------------------------------------------
+    # Read from a seed connection (called by the event loop when it is readable)
+    # and handle each complete message.
     # -----------------------------------------------------------------------
     def handle_seed_connection(self, connection):
-        while True:
-            try:
-                data = connection.recv(1024)
-                if not data:
-                    break
-                data = data.decode().strip()
-                self.log(f"Received from seed {self.get_conn_info(connection)}: {data}")
-                if data.startswith("PEERS:"):
-                    # Expected format: PEERS:<ip>:<port>;<ip>:<port>;...
-                    peers_str = data.split("PEERS:")[1]
-                    if peers_str:
-                        entries = peers_str.split(";")
-                        for entry in entries:
-                            if entry:
-                                ip, port = entry.split(":")
-                                self.peers.add((ip, int(port)))
-                                self.log(f"Updated peer list with: {ip}:{port}")
-                elif data.startswith("Dead Node:"):
-                    self.log(f"Dead node reported: {data}")
-            except Exception as e:
-                self.log(f"Error in seed connection: {e}")
-                break
-        connection.close()
+        try:
+            messages = self.read_messages(connection)
+            if messages is None:
+                self.close_connection(connection)
+                return
+            for message in messages:
+                self.handle_seed_message(connection, message)
+        except Exception as e:
+            self.log(f"Error in seed connection: {e}")
+            self.close_connection(connection)
 
     # -----------------------------------------------------------------------
-    # Handle incoming messages from another peer.
-    # Processes registration messages, dead node notifications, and gossip messages.
-    # For new gossip messages, the message is forwarded to all connected peers (except sender).
+    # Handle a single message from a seed node.
+    # Processes peer list updates and dead node notifications.
     # -----------------------------------------------------------------------
-    def handle_peer_connection(self, connection):
-        while True:
-            try:
-                data = connection.recv(1024)
-                if not data:
-                    break
-                data = data.decode().strip()
-                sender_info = self.get_conn_info(connection)
-                self.log(f"Received from peer {sender_info}: {data}")
-                if data.startswith("STORE-"):
-                    # Process registration message from peer.
-                    try:
-                        host_port_str = data.split("STORE-")[1]
-                        ip, port = host_port_str.split(":")
-                        port = int(port)
-                        # Update the mapping for the designated port.
-                        self.conn_designated[connection] = (ip, port)
-                        # Add the peer to the connected list if not already present.
-                        if (ip, port) not in [(p[0], p[1]) for p in self.connected]:
-                            self.connected.append([ip, port, connection])
-                    except Exception as e:
-                        self.log(f"Error parsing STORE message: {e}")
-                elif data.startswith("Dead Node:"):
-                    self.log(f"Received dead node message: {data}")
-                elif ":" in data:
-                    # Assume the data is a gossip message in the expected format.
-                    msg_hash = hashlib.sha256(data.encode()).hexdigest()
-                    # Only process if the message has not been seen before.
-                    if not any(m.hash == msg_hash for m in self.messages):
-                        new_msg = Message(data)
-                        new_msg.received_from.append(self.get_conn_info(connection))
-                        self.messages.append(new_msg)
-                        self.log(f"New gossip message received: {data}")
-                        # Forward the gossip message to all peers except the sender.
-                        self.forward_message(data, exclude=connection)
-            except Exception as e:
-                self.log(f"Error handling peer connection: {e}")
-                break
-        connection.close()
+    def handle_seed_message(self, connection, data):
+        try:
+            data = data.decode().strip()
+            self.log(f"Received from seed {self.get_conn_info(connection)}: {data}")
+            if data.startswith("PEERS:"):
+                # Expected format: PEERS:<ip>:<port>;<ip>:<port>;...
+                peers_str = data.split("PEERS:")[1]
+                if peers_str:
+                    parsed = {(ip, int(port)) for entry in peers_str.split(";") if entry
+                              for ip, port in (entry.split(":", 1),)}
+                    new_peers = parsed - self.peers
+                    self.peers.update(parsed)
+                    if new_peers:
+                        self.log(f"Updated peer list with {len(new_peers)} new peers: "
+                                 + ", ".join(f"{ip}:{port}" for ip, port in sorted(new_peers)))
+                self.peers_received.set()
+            elif data.startswith("Dead Node:"):
+                self.log(f"Dead node reported: {data}")
+        except Exception as e:
+            self.log(f"Error handling seed message: {e}")
 
     # -----------------------------------------------------------------------
-    # Forward a message to all connected peers except the one specified in 'exclude'.
-    # Logs the forwarding event along with connection details.
+    # Read from a peer connection (called by the event loop when it is readable).
+    # Incoming data is accumulated until complete length-prefixed messages
+    # are available, and each message is then handled separately.
     # -----------------------------------------------------------------------
-    def forward_message(self, message, exclude=None):
-        for peer in self.connected:
-            peer_ip, peer_port, conn = peer
-            try:
-                # Skip forwarding to the excluded connection.
-                if exclude and conn.getpeername() == exclude.getpeername():
-                    continue
-            except Exception:
-                pass
-            try:
-                conn.sendall(message.encode())
-                self.log(f"Forwarded message to {peer_ip}:{peer_port} (Ephemeral: {conn.getsockname()[1]}) : {message}")
-            except Exception as e:
-                self.log(f"Failed to forward message to {peer_ip}:{peer_port} (Ephemeral: {conn.getsockname()[1]}): {e}")
+    def handle_peer_connection(self, connection):
+        try:
+            messages = self.read_messages(connection)
+            if messages is None:
+                designated = self.conn_designated.get(connection)
+                if designated is not None:
+                    if self.connected.get(designated) is connection:
+                        # Stop announcing to the closed connection and allow the peer to be
+                        # dialled again; the heartbeat entry stays so the peer is still
+                        # reported dead if it does not come back.
+                        del self.connected[designated]
+                    else:
+                        # Stop monitoring a connection that was replaced by another one to the same peer.
+                        self.heartbeats.pop(connection, None)
+                else:
+                    # The connection closed before registering (e.g. the other side kept a
+                    # different connection to us); there is no designated peer to report.
+                    self.heartbeats.pop(connection, None)
+                self.close_connection(connection)
+                return
+            for message in messages:
+                self.handle_peer_message(connection, message)
+        except Exception as e:
+            self.log(f"Error handling peer connection: {e}")
+            self.close_connection(connection)
 
     # -----------------------------------------------------------------------
-    # Ping a given IP address using the system 'ping' command.
-    # Returns True if the ping succeeds, False otherwise.
+    # Handle a single message from another peer.
+    # Processes registration messages, dead node notifications, heartbeats
+    # (PING/PONG), hash announcements (HAVE/WANT) and gossip messages.
+    # A HAVE for an unseen hash that has not been requested yet is answered
+    # with a WANT; a WANT is answered with the cached payload. New gossip
+    # messages are announced to all connected peers (except sender).
     # -----------------------------------------------------------------------
-    def ping_peer(self, ip):
+    def handle_peer_message(self, connection, data_bytes):
         try:
-            # For Unix/Linux: using "-c 1" sends one ping request.
-            # On Windows, replace "-c" with "-n" if needed.
-            subprocess.check_output(["ping", "-c", "1", ip], stderr=subprocess.STDOUT)
-            return True
-        except subprocess.CalledProcessError:
-            return False
+            data_bytes = data_bytes.strip()
+            data = data_bytes.decode()
+            if not data:
+                return
+            sender_info = self.get_conn_info(connection)
+            self.log(f"Received from peer {sender_info}: {data}")
+            if data.startswith("STORE-"):
+                # Process registration message from peer.
+                try:
+                    host_port_str = data.split("STORE-")[1]
+                    ip, port = host_port_str.split(":")
+                    port = int(port)
+                    # Update the mapping for the designated port.
+                    self.conn_designated[connection] = (ip, port)
+                    # Monitor the peer under its designated address rather than the ephemeral one.
+                    state = self.heartbeats.get(connection)
+                    if state:
+                        state[0], state[1] = ip, port
+                    existing = self.connected.get((ip, port))
+                    if existing is None:
+                        self.connected[(ip, port)] = connection
+                    elif existing is not connection:
+                        # Already connected to this peer. If both peers connected to each other,
+                        # keep the connection initiated by the lower (ip, port) so both ends
+                        # close the same one; otherwise the newer connection replaces the old one.
+                        if existing in self.outgoing and (self.host, self.port) < (ip, port):
+                            redundant = connection
+                        else:
+                            self.connected[(ip, port)] = connection
+                            redundant = existing
+                        self.log(f"Closing redundant connection to {ip}:{port} (Ephemeral: {self.get_local_port(redundant)})")
+                        self.heartbeats.pop(redundant, None)
+                        self.close_connection(redundant)
+                except Exception as e:
+                    self.log(f"Error parsing STORE message: {e}")
+            elif data.startswith("Dead Node:"):
+                self.log(f"Received dead node message: {data}")
+            elif data == "PING":
+                self.send_message(connection, b"PONG")
+            elif data == "PONG":
+                state = self.heartbeats.get(connection)
+                if state:
+                    state[3] = True
+            elif data.startswith("HAVE-"):
+                # Hash announcement: request the payload only if it is new to us.
+                try:
+                    msg_hash = int(data.split("HAVE-")[1], 16)
+                    if self.request_hash(msg_hash, connection):
+                        self.send_message(connection, f"WANT-{msg_hash:016x}".encode())
+                except ValueError as e:
+                    self.log(f"Error parsing HAVE message: {e}")
+            elif data.startswith("WANT-"):
+                # Payload request: send the gossip message if it is still cached.
+                try:
+                    msg_hash = int(data.split("WANT-")[1], 16)
+                    payload = self.hash_to_payload.get(msg_hash)
+                    if payload is not None:
+                        self.send_message(connection, payload)
+                        self.log(f"Sent requested message to {sender_info}: {payload.decode()}")
+                except ValueError as e:
+                    self.log(f"Error parsing WANT message: {e}")
+            elif ":" in data:
+                # Assume the data is a gossip message in the expected format.
+                msg_hash = xxhash.xxh3_64_intdigest(data_bytes)
+                self.pending_wants.pop(msg_hash, None)
+                # Only process if the message has not been seen before.
+                if self.mark_seen(msg_hash):
+                    new_msg = Message(data, data_bytes)
+                    new_msg.received_from.append(self.get_conn_info(connection))
+                    self.messages.append(new_msg)
+                    self.cache_payload(msg_hash, data_bytes)
+                    self.log(f"New gossip message received: {data}")
+                    # Announce the gossip message to all peers except the sender.
+                    self.forward_message(msg_hash, exclude=connection)
+        except Exception as e:
+            self.log(f"Error handling peer message: {e}")
+
+    # -----------------------------------------------------------------------
+    # Announce a message to all connected peers except the one specified in 'exclude'.
+    # Only the message hash is sent ("HAVE-<hash>"); peers that have not seen
+    # the message reply with "WANT-<hash>" and receive the full payload.
+    # Logs the forwarding event along with connection details.
+    # -----------------------------------------------------------------------
+    def forward_message(self, msg_hash, exclude=None):
+        announce = f"HAVE-{msg_hash:016x}"
+        # Encode once; the same bytes are queued for every peer.
+        payload = announce.encode()
+        # Peer the message came from, identified by its designated address.
+        excluded_peer = self.conn_designated.get(exclude) if exclude is not None else None
+        # Iterate over a snapshot; the event loop may add peers concurrently.
+        # connected holds one connection per designated peer, so each peer is announced to once.
+        for (peer_ip, peer_port), conn in list(self.connected.items()):
+            # Skip forwarding to the peer the message came from.
+            if (peer_ip, peer_port) == excluded_peer:
+                continue
+            self.send_message(conn, payload)
+            self.log(f"Announced message to {peer_ip}:{peer_port} (Ephemeral: {self.get_local_port(conn)}) : {announce}")
 
     # -----------------------------------------------------------------------
-    # Heartbeat mechanism: periodically pings a peer.
+    # Heartbeat mechanism: run by the event loop every HEARTBEAT_INTERVAL seconds.
+    # Sends a PING over every monitored peer connection. A PING counts as
+    # failed if no PONG arrived before the next one is due.
     # If 3 consecutive pings fail, the peer is marked as dead, removed, and
     # a dead node message is sent to all seed nodes.
     # -----------------------------------------------------------------------
-    def heartbeat(self, connection, peer_ip, peer_port):
-        failures = 0
-        while failures < 3:
-            time.sleep(13)
-            if self.ping_peer(peer_ip):
+    def heartbeat(self):
+        for connection, state in list(self.heartbeats.items()):
+            peer_ip, peer_port, failures, pong_received = state
+            if pong_received:
                 failures = 0
             else:
                 failures += 1
-                self.log(f"Ping failure {failures} for peer {peer_ip}:{peer_port} (Ephemeral: {connection.getsockname()[1]})")
-        self.log(f"3 consecutive ping failures. Peer {peer_ip}:{peer_port} (Ephemeral: {connection.getsockname()[1]}) is dead.")
-        # Remove the dead peer from the connected list.
-        self.connected = [p for p in self.connected if not (p[0]==peer_ip and p[1]==peer_port)]
-        # Report the dead node to all connected seed nodes.
-        self.send_dead_node_to_seeds(peer_ip, peer_port)
-        try:
-            connection.close()
-        except Exception:
-            pass
+                self.log(f"Ping failure {failures} for peer {peer_ip}:{peer_port}")
+            if failures >= HEARTBEAT_MAX_FAILURES:
+                current = self.connected.get((peer_ip, peer_port))
+                if current is not None and current is not connection:
+                    # The peer has reconnected since this connection closed; it is alive.
+                    del self.heartbeats[connection]
+                    self.close_connection(connection)
+                    continue
+                self.log(f"{HEARTBEAT_MAX_FAILURES} consecutive ping failures. Peer {peer_ip}:{peer_port} is dead.")
+                del self.heartbeats[connection]
+                # Remove the dead peer from the connected peers.
+                if current is connection:
+                    del self.connected[(peer_ip, peer_port)]
+                # Report the dead node to all connected seed nodes.
+                self.send_dead_node_to_seeds(peer_ip, peer_port)
+                self.close_connection(connection)
+                continue
+            state[2] = failures
+            state[3] = False
+            # A connection closed at EOF is only kept to count failures; don't write to it.
+            if connection.fileno() != -1:
+                self.send_message(connection, b"PING")
 
     # -----------------------------------------------------------------------
     # Send a dead node notification to all connected seed nodes.
     # The message format is: "Dead Node:<dead_ip>:<dead_port>:<timestamp>:<reporter_IP>"
     # -----------------------------------------------------------------------
     def send_dead_node_to_seeds(self, dead_ip, dead_port):
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = now_ts()
         data = f"Dead Node:{dead_ip}:{dead_port}:{timestamp}:{self.host}"
         for seed_conn in self.seed:
             try:
-                seed_conn.sendall(data.encode())
-                self.log(f"Sent dead node message to seed {seed_conn.getpeername()}: {data}")
+                send_frame(seed_conn, data.encode())
+                self.log(f"Sent dead node message to seed {self.get_conn_info(seed_conn)}: {data}")
             except Exception as e:
                 self.log(f"Failed to send dead node message to seed: {e}")
 
     # -----------------------------------------------------------------------
     # Gossip function: Generates and broadcasts exactly 10 gossip messages,
-    # one every 5 seconds. The message index is displayed starting at 1 for clarity.
+    # one every 5 seconds, starting GOSSIP_START_DELAY seconds after the peer starts.
+    # The message index is displayed starting at 1 for clarity.
     # -----------------------------------------------------------------------
     def gossip(self):
+        time.sleep(GOSSIP_START_DELAY)
         for i in range(10):
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            timestamp = now_ts()
             # Message format: "<timestamp>:<host>:Msg#<i+1> - Gossip broadcast from <host>:<port>"
             message_text = f"{timestamp}:{self.host}:Msg#{i+1} - Gossip broadcast from {self.host}:{self.port}"
             new_msg = Message(message_text)
             # Log that this message originates from this peer.
             new_msg.received_from.append(f"Designated: {self.host}:{self.port}")
+            self.mark_seen(new_msg.hash)
             self.messages.append(new_msg)
+            self.cache_payload(new_msg.hash, new_msg.data_bytes)
             self.log(f"Broadcasting gossip message ({i+1}/10): {message_text}")
-            # Forward the gossip message to all connected peers.
-            self.forward_message(message_text)
+            # Announce the gossip message to all connected peers.
+            self.forward_message(new_msg.hash)
             time.sleep(5)
 
     # -----------------------------------------------------------------------
-    # Listen for incoming peer connections.
-    # Binds the peer's listening socket to its host and port.
-    # For each accepted connection, starts threads for handling messages and heartbeat.
+    # Accept an incoming peer connection (called by the event loop when the
+    # listening socket is readable) and start serving and monitoring it.
+    # -----------------------------------------------------------------------
+    def accept_connection(self, sock):
+        try:
+            conn, addr = sock.accept()
+        except (BlockingIOError, InterruptedError, ConnectionAbortedError):
+            # The pending connection went away before it could be accepted.
+            return
+        except Exception as e:
+            # The listening socket itself failed; stop the event loop.
+            self.log(f"Error accepting peer connection: {e}")
+            self.running = False
+            return
+        try:
+            self.configure_connection(conn)
+            self.cache_conn_meta(conn)
+            self.log(f"Accepted connection from peer {addr} (Ephemeral: {self.get_local_port(conn)})")
+            self.selector.register(conn, selectors.EVENT_READ, self.handle_peer_connection)
+            # Start heartbeat for the incoming connection using the address info.
+            self.heartbeats[conn] = [addr[0], addr[1], 0, True]
+        except Exception as e:
+            # Only this connection is affected (e.g. reset right after accept);
+            # drop it and keep serving the others.
+            self.log(f"Error setting up peer connection from {addr}: {e}")
+            self.close_connection(conn)
+
+    # -----------------------------------------------------------------------
+    # Listen for incoming peer connections and run the peer's event loop.
+    # Binds the peer's listening socket to its host and port, then serves the
+    # listening socket and every peer/seed connection from this one thread,
+    # flushing queued messages and running the heartbeat whenever they are due.
+    # Once close_socket() stops the loop, all connections are closed here.
     # -----------------------------------------------------------------------
     def listen(self):
         self.socket.bind((self.host, self.port))
         self.socket.listen(10)
         self.log(f"Listening for peer connections on {self.host}:{self.port}")
-        while True:
+        self.selector.register(self.socket, selectors.EVENT_READ, self.accept_connection)
+        self.running = True
+        self.listen_ready.set()
+        while self.running:
+            deadline = self.next_heartbeat
+            flush_deadline = self.flush_deadline
+            if flush_deadline is not None:
+                deadline = min(deadline, flush_deadline)
+            timeout = min(SELECT_TIMEOUT, max(0, deadline - time.monotonic()))
             try:
-                conn, addr = self.socket.accept()
-                self.log(f"Accepted connection from peer {addr} (Ephemeral: {conn.getsockname()[1]})")
-                threading.Thread(target=self.handle_peer_connection, args=(conn,), daemon=True).start()
-                # Start heartbeat for the incoming connection using the address info.
-                threading.Thread(target=self.heartbeat, args=(conn, addr[0], addr[1]), daemon=True).start()
-            except Exception as e:
-                self.log(f"Error accepting peer connection: {e}")
+                events = self.selector.select(timeout)
+            except (OSError, ValueError):
                 break
+            for key, mask in events:
+                # Each registration's data is its read handler; pending writes
+                # are retried once the handler has run (it may close the socket).
+                if mask & selectors.EVENT_READ:
+                    key.data(key.fileobj)
+                if mask & selectors.EVENT_WRITE:
+                    self.write_connection(key.fileobj)
+            flush_deadline = self.flush_deadline
+            if flush_deadline is not None and time.monotonic() >= flush_deadline:
+                self.flush_send_buffers()
+            if time.monotonic() >= self.next_heartbeat:
+                self.heartbeat()
+                self.next_heartbeat += HEARTBEAT_INTERVAL
+            # select() wakes at least every SELECT_TIMEOUT, so overdue WANTs are retried promptly.
+            self.expire_wants()
+        # The loop has stopped: close every peer/seed connection and the
+        # listening socket from this thread, then the loop's own resources.
+        try:
+            for key in list(self.selector.get_map().values()):
+                if key.fileobj is not self.wakeup_r:
+                    self.close_connection(key.fileobj)
+            self.close_connection(self.socket)
+            self.log("Peer closed successfully.")
+        except Exception as e:
+            self.log(f"Error closing the peer: {e}")
+        self.selector.close()
+        self.wakeup_r.close()
+        self.wakeup_w.close()
 
     # -----------------------------------------------------------------------
-    # Start the peer node: begins listening for incoming connections and starts the gossip thread.
+    # Start the peer node: starts the event loop thread (listening for incoming
+    # connections) and the gossip thread.
     # -----------------------------------------------------------------------
     def start(self):
-        threading.Thread(target=self.listen, daemon=True).start()
-        # Wait a short period to allow initial connections to be established.
-        time.sleep(3)
+        self.loop_thread = threading.Thread(target=self.listen, daemon=True)
+        self.loop_thread.start()
+        # Return once the peer accepts connections; gossip starts after GOSSIP_START_DELAY.
+        if not self.listen_ready.wait(STARTUP_TIMEOUT):
+            self.log("Listening socket not ready; continuing startup.")
         threading.Thread(target=self.gossip, daemon=True).start()
 
     # -----------------------------------------------------------------------
@@ -307,18 +781,14 @@ class Peer:
     # -----------------------------------------------------------------------
     def close_socket(self):
         self.log("Closing all connections.")
+        # Stop the event loop and wake it; the loop thread closes the connections
+        # itself, so no socket is closed while the loop may be using it.
+        self.running = False
         try:
-            for peer in self.connected:
-                try:
-                    peer[2].close()
-                except:
-                    pass
-            for seed_conn in self.seed:
-                try:
-                    seed_conn.close()
-                except:
-                    pass
-            self.socket.close()
-            self.log("Peer closed successfully.")
-        except Exception as e:
-            self.log(f"Error closing the peer: {e}")
+            self.wakeup_w.send(b"\0")
+        except OSError:
+            pass
+        if self.loop_thread is not None:
+            self.loop_thread.join(STARTUP_TIMEOUT)
+        # Flush pending log lines and close the log file.
+        self.log_listener.stop()
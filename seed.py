@@ -1,7 +1,7 @@
 # seed.py
 import socket
 import threading
-import datetime
+from common import STARTUP_TIMEOUT, create_logger, encode_frame, now_ts, recv_frame, send_frame
 
 class Seed:
     def __init__(self, host, port):
@@ -9,16 +9,27 @@ class Seed:
         Initialize the seed node with a given host and port.
         - Creates a TCP socket.
         - Sets socket option to reuse the address.
-        - Initializes lists to track active connections and the peer list.
+        - Initializes containers to track active connections and the peer list.
         """
         self.host = host
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Allow the socket to reuse the address (helps during quick restarts)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.connections = []  # List of active socket connections from peers.
+        self.connections = set()  # Set of active socket connections from peers.
         self.logfile = f"logfile_seed_{self.port}.txt"  # Log file name based on port.
-        self.peer_list = []    # List to store tuples (ip, port) of registered peers.
+        # Logger writing to the console and the log file from a background thread.
+        self.logger, self.log_listener = create_logger(f"seed.{self.port}", self.logfile)
+        self.peer_list = set()  # Set of (ip, port) tuples of registered peers.
+        # Guards peer_list and the cached PEERS message across client threads.
+        self.peer_list_lock = threading.Lock()
+        # Cached "PEERS:..." message (text and encoded frame), rebuilt only
+        # after peer_list has changed.
+        self.peer_list_data = "PEERS:"
+        self.peer_list_frame = encode_frame(self.peer_list_data.encode())
+        self.peer_list_dirty = False
+        # Set once the listening socket accepts connections.
+        self.listen_ready = threading.Event()
 
     def listen(self):
         """
@@ -28,37 +39,46 @@ class Seed:
         self.socket.bind((self.host, self.port))
         self.socket.listen(10)
         self.log(f"Listening for connections on {self.host}:{self.port}")
+        self.listen_ready.set()
 
         while True:
             # Accept an incoming connection
             connection, address = self.socket.accept()
-            self.connections.append(connection)
+            self.connections.add(connection)
             self.log(f"Accepted connection from {address}")
             # Start a new thread to handle communication with the connected peer
             threading.Thread(target=self.handle_client, args=(connection, address), daemon=True).start()
 
-    def send_data(self, connection, data):
+    def send_data(self, connection, data, frame=None):
         """
-        Send a data string to a specified connection.
+        Send a data string to a specified connection as a length-prefixed message.
+        If 'frame' is given it must be the already-encoded message for 'data'.
         Log the action and remove the connection if sending fails.
         """
         try:
-            connection.sendall(data.encode())
+            if frame is None:
+                send_frame(connection, data.encode())
+            else:
+                connection.sendall(frame)
             self.log(f"Sent data to {connection.getpeername()}: {data}")
         except socket.error as e:
             self.log(f"Failed to send data. Error: {e}")
-            try:
-                self.connections.remove(connection)
-            except Exception:
-                pass
+            self.connections.discard(connection)
 
     def send_peer_list(self, connection):
         """
-        Format the current peer list into a string and send it to the given connection.
+        Send the current peer list to the given connection.
         Format: "PEERS:<ip>:<port>;<ip>:<port>;..."
+        The formatted and encoded message is cached and only rebuilt when the
+        peer list has changed since it was last sent.
         """
-        data = "PEERS:" + ";".join(f"{ip}:{port}" for ip, port in self.peer_list)
-        self.send_data(connection, data)
+        with self.peer_list_lock:
+            if self.peer_list_dirty:
+                self.peer_list_data = "PEERS:" + ";".join(f"{ip}:{port}" for ip, port in self.peer_list)
+                self.peer_list_frame = encode_frame(self.peer_list_data.encode())
+                self.peer_list_dirty = False
+            data, frame = self.peer_list_data, self.peer_list_frame
+        self.send_data(connection, data, frame)
 
     def handle_client(self, connection, address):
         """
@@ -70,10 +90,12 @@ class Seed:
         self.log(f"Connection from {address} opened.")
         # Send the current list of peers to the newly connected client
         self.send_peer_list(connection)
+        # Accumulator for partially received length-prefixed messages.
+        recv_buf = bytearray()
         while True:
             try:
-                data = connection.recv(1024)
-                if not data:
+                data = recv_frame(connection, recv_buf)
+                if data is None:
                     # If no data received, break the loop (connection closed)
                     break
                 data = data.decode().strip()
@@ -86,9 +108,11 @@ class Seed:
                         host, port = host_port_str.split(":")
                         port = int(port)
                         # Add the peer to the peer_list if it's not already present
-                        if (host, port) not in self.peer_list:
-                            self.peer_list.append((host, port))
-                            self.log(f"Added peer {host}:{port}. New peer list: {self.peer_list}")
+                        with self.peer_list_lock:
+                            if (host, port) not in self.peer_list:
+                                self.peer_list.add((host, port))
+                                self.peer_list_dirty = True
+                                self.log(f"Added peer {host}:{port}. New peer list: {self.peer_list}")
                     except Exception as e:
                         self.log(f"Error parsing STORE message: {e}")
                         
@@ -99,35 +123,41 @@ class Seed:
                         dead_ip = parts[1]
                         dead_port = int(parts[2])
                         # Remove the peer from the list if present
-                        if (dead_ip, dead_port) in self.peer_list:
-                            self.peer_list.remove((dead_ip, dead_port))
-                            self.log(f"Removed dead peer {dead_ip}:{dead_port}. Updated peer list: {self.peer_list}")
+                        with self.peer_list_lock:
+                            if (dead_ip, dead_port) in self.peer_list:
+                                self.peer_list.discard((dead_ip, dead_port))
+                                self.peer_list_dirty = True
+                                self.log(f"Removed dead peer {dead_ip}:{dead_port}. Updated peer list: {self.peer_list}")
                     except Exception as e:
                         self.log(f"Error parsing Dead Node message: {e}")
             except socket.error:
                 # If a socket error occurs, exit the loop
                 break
+            except ValueError as e:
+                # Malformed framing (e.g. an oversized length header): drop the client.
+                self.log(f"Invalid message from {address}: {e}")
+                break
 
         self.log(f"Connection from {address} closed.")
-        try:
-            self.connections.remove(connection)
-        except Exception:
-            pass
+        self.connections.discard(connection)
         connection.close()
 
     def start(self):
         """
         Start the seed node's listening process on a new daemon thread.
+        Returns once the seed accepts connections, or logs that it is not
+        ready after STARTUP_TIMEOUT seconds (e.g. if binding the port failed).
         """
         threading.Thread(target=self.listen, daemon=True).start()
+        if not self.listen_ready.wait(STARTUP_TIMEOUT):
+            self.log(f"Listening socket on {self.host}:{self.port} not ready; peers may fail to connect.")
 
     def log(self, message):
         """
         Log a message with a timestamp.
-        The message is printed to the console and also appended to the logfile.
+        The message is printed to the console and also appended to the logfile
+        by the logger's background listener thread.
         """
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        timestamp = now_ts()
         log_message = f"[{timestamp}] {message}"
-        print(log_message)
-        with open(self.logfile, "a") as f:
-            f.write(log_message + "\n")
+        self.logger.info(log_message)